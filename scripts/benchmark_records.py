@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Mede a memória usada para transformar as linhas de clientes antes de as enviar ao Supabase
+Separa os dois efeitos da camada de registos, com três modos:
+- dataframe: pd.read_sql_query + iterrows + um dicionário por linha (caminho antigo);
+- fetchmany: leitura em lotes com fetchmany + um dicionário por linha;
+- records:   leitura em lotes com fetchmany + ClientRecord com __slots__ + payload do lote.
+dataframe vs fetchmany mostra o efeito de não carregar a tabela inteira (pico de RSS);
+fetchmany vs records mostra o efeito do registo com __slots__ face ao dicionário (bytes por linha).
+
+Os bytes por linha são medidos diretamente com tracemalloc num lote de DEFAULT_BATCH_SIZE linhas:
+memória ocupada pelas linhas transformadas e, no momento do envio, pelo lote completo
+(no modo records, registos + payload). Cada modo corre num processo separado para que o pico
+de RSS de um não afete o outro. Não faz pedidos ao Supabase.
+
+Uso:
+    python benchmark_records.py [número de linhas]
+"""
+
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+from migration_records import DEFAULT_BATCH_SIZE, build_batch_payload, iter_table_batches, table_columns
+from migrate_from_sql import SQLToSupabaseMigrator
+
+DEFAULT_ROWS = 200000
+MODES = ['dataframe', 'fetchmany', 'records']
+
+
+def create_legacy_db(path: str, rows: int):
+    """Cria uma base de dados legacy de teste com uma tabela de pacientes"""
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE pacientes (id INTEGER PRIMARY KEY, nome TEXT, data_nascimento TEXT, "
+                       "email TEXT, telefone TEXT, observacoes TEXT)")
+    connection.executemany(
+        "INSERT INTO pacientes (nome, data_nascimento, email, telefone, observacoes) VALUES (?, ?, ?, ?, ?)",
+        ((f"Paciente {i}", f"{1 + i % 28:02d}/{1 + i % 12:02d}/19{50 + i % 50}",
+          f"paciente{i}@exemplo.pt" if i % 3 else None, f"91{i:07d}", f"Observações do paciente {i}")
+         for i in range(rows))
+    )
+    connection.commit()
+    connection.close()
+
+
+def dict_transform(migrator: SQLToSupabaseMigrator, row, mapping: Dict[str, str]) -> Optional[Dict]:
+    """Transformação antiga: um dicionário novo por linha (Series do DataFrame ou sqlite3.Row)"""
+    if 'name' not in mapping or pd.isna(row[mapping['name']]):
+        return None
+    client_data = {'name': str(row[mapping['name']]).strip()}
+    birth_date = None
+    if 'birth_date' in mapping and not pd.isna(row[mapping['birth_date']]):
+        birth_date = migrator.parse_date(row[mapping['birth_date']])
+    client_data['birth_date'] = birth_date or '1900-01-01'
+    if 'email' in mapping and not pd.isna(row[mapping['email']]):
+        email = str(row[mapping['email']]).strip()
+        if '@' in email:
+            client_data['email'] = email
+    if 'phone' in mapping and not pd.isna(row[mapping['phone']]):
+        client_data['phone'] = str(row[mapping['phone']]).strip()
+    if 'notes' in mapping and not pd.isna(row[mapping['notes']]):
+        client_data['notes'] = str(row[mapping['notes']]).strip()
+    return client_data
+
+
+def source_batches(mode: str, migrator: SQLToSupabaseMigrator) -> Iterator[Sequence]:
+    """Lotes de linhas da tabela de pacientes, lidos como no modo indicado"""
+    if mode == 'dataframe':
+        df = pd.read_sql_query("SELECT * FROM pacientes", migrator.connection)
+        rows = [row for _, row in df.iterrows()]
+        for start in range(0, len(rows), DEFAULT_BATCH_SIZE):
+            yield rows[start:start + DEFAULT_BATCH_SIZE]
+    else:
+        yield from iter_table_batches(migrator.connection, 'pacientes', DEFAULT_BATCH_SIZE)
+
+
+def transformer(mode: str, migrator: SQLToSupabaseMigrator) -> Callable:
+    mapping = migrator.map_client_columns(table_columns(migrator.connection, 'pacientes'))
+    if mode == 'records':
+        return lambda row: migrator.transform_client_data(row, mapping)
+    return lambda row: dict_transform(migrator, row, mapping)
+
+
+def batch_to_send(mode: str, transformed: List) -> List:
+    """O que fica em memória no momento do envio de um lote"""
+    if mode == 'records':
+        return [transformed, build_batch_payload(transformed)]
+    return [transformed]
+
+
+def run(mode: str, migrator: SQLToSupabaseMigrator) -> int:
+    """Percorre a tabela inteira como a migração; devolve o número de linhas transformadas"""
+    transform = transformer(mode, migrator)
+    count = 0
+    for rows in source_batches(mode, migrator):
+        transformed = [item for item in (transform(row) for row in rows) if item]
+        batch_to_send(mode, transformed)
+        count += len(transformed)
+    return count
+
+
+def bytes_per_row(mode: str, migrator: SQLToSupabaseMigrator) -> List[float]:
+    """Bytes por linha de um lote: só as linhas transformadas, e o lote completo no envio"""
+    transform = transformer(mode, migrator)
+    rows = next(source_batches(mode, migrator))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    transformed = [item for item in (transform(row) for row in rows) if item]
+    after_transform = tracemalloc.get_traced_memory()[0]
+    batch = batch_to_send(mode, transformed)
+    after_batch = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    count = len(transformed)
+    del batch
+    return [(after_transform - before) / count, (after_batch - before) / count]
+
+
+def measure(mode: str, db_path: str):
+    """Corre um modo e imprime: linhas, pico de RSS (KiB), bytes/linha transformada, bytes/linha no envio, tempo (s)"""
+    migrator = object.__new__(SQLToSupabaseMigrator)
+    migrator.connection = sqlite3.connect(db_path)
+    migrator.connection.row_factory = sqlite3.Row
+
+    # Silenciar prints do mapeamento de colunas
+    sys.stdout = open(os.devnull, 'w')
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    rows = run(mode, migrator)
+    elapsed = time.perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    transformed_bytes, batch_bytes = bytes_per_row(mode, migrator)
+    sys.stdout = sys.__stdout__
+
+    print(rows, rss_peak - rss_before, f"{transformed_bytes:.1f}", f"{batch_bytes:.1f}", f"{elapsed:.3f}")
+
+
+def main():
+    """Função principal"""
+    if len(sys.argv) > 2 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], sys.argv[3])
+        return
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'legacy.db')
+        create_legacy_db(db_path, rows)
+
+        print(f"Linhas: {rows} (lotes de {DEFAULT_BATCH_SIZE})")
+        print(f"{'Modo':<10} {'Pico RSS (MiB)':>15} {'Linha transformada (B)':>23} "
+              f"{'Lote no envio (B/linha)':>24} {'Tempo (s)':>10}")
+        for mode in MODES:
+            output = subprocess.run([sys.executable, __file__, '--measure', mode, db_path],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            rss_kib, transformed_bytes, batch_bytes, elapsed = int(output[1]), output[2], output[3], output[4]
+            print(f"{mode:<10} {rss_kib / 1024:>15.1f} {transformed_bytes:>23} {batch_bytes:>24} {elapsed:>10}")
+
+if __name__ == "__main__":
+    main()
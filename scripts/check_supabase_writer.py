@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Verificação da camada de escrita (supabase_writer.py) contra o servidor com falhas injetadas
+Arranca fault_server.py numa porta livre e confirma que:
+- os erros transitórios (429, 503, timeouts, ligações cortadas, escritas feitas com a resposta
+  perdida, corpos truncados) são repetidos até as linhas ficarem escritas;
+- as linhas inválidas vão para o dead-letter e podem ser reprocessadas;
+- só erros causados pelos dados dividem um lote; chaves erradas e colunas desconhecidas
+  mandam o lote inteiro para o dead-letter numa só entrada;
+- clientes já existentes são contados uma só vez, mesmo quando o lote é dividido;
+- cadeias dependentes (cliente -> consulta -> nota) vão inteiras para o dead-letter;
+- repetir a migração (migrate_from_sql.py) não cria duplicados, mesmo com linhas legacy apagadas;
+- um reprocessamento interrompido não perde entradas do dead-letter.
+
+Uso:
+    python check_supabase_writer.py
+"""
+
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from typing import Dict, List, Optional
+
+import requests
+
+from fault_server import create_server
+from supabase_writer import SupabaseWriter, idempotency_key
+
+FAULT_RATE = 0.3
+CLIENT_TIMEOUT = 0.3
+
+
+def start_server(fault_rate: float = FAULT_RATE, faults: Optional[List[str]] = None,
+                 api_key: Optional[str] = None, columns: Optional[Dict[str, List[str]]] = None):
+    """Arranca o servidor com falhas numa porta livre; "slow" demora mais do que o timeout do cliente"""
+    server = create_server(0, fault_rate=fault_rate, slow_delay=CLIENT_TIMEOUT * 3, faults=faults,
+                           api_key=api_key, columns=columns)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def new_writer(url: str, dead_letter_path: str) -> SupabaseWriter:
+    return SupabaseWriter(url, 'chave-de-teste', max_in_flight=4, max_retries=12, base_delay=0.01,
+                          max_delay=0.05, timeout=CLIENT_TIMEOUT, dead_letter_path=dead_letter_path)
+
+
+def read_entries(path: str):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_retries_dead_letter_and_replay(tmp: str):
+    server, url = start_server()
+    dead_letter_path = os.path.join(tmp, 'batches.jsonl')
+    writer = new_writer(url, dead_letter_path)
+
+    def submit_all(reject: bool):
+        for batch in range(40):
+            rows = [{'name': f"Cliente {batch}-{i}", 'birth_date': '1900-01-01'} for i in range(25)]
+            if reject and batch == 7:
+                rows[3]['reject'] = True
+            writer.submit('clients', rows, [f"teste:{batch}:{i}" for i in range(25)])
+        writer.wait_all()
+
+    with redirect_stdout(io.StringIO()):
+        submit_all(reject=True)
+    stored = server.tables['clients']
+    assert server.stats['faults'] > 0, "nenhuma falha injetada"
+    assert server.stats['requests'] > 40, "nenhuma repetição"
+    assert len(stored) == 999, f"esperadas 999 linhas, encontradas {len(stored)}"
+    assert writer.counts('clients') == {'written': 999, 'failed': 1, 'skipped': 0}, writer.counts('clients')
+
+    entries = read_entries(dead_letter_path)
+    assert len(entries) == 1 and entries[0]['steps'][0]['rows'][0]['name'] == 'Cliente 7-3', entries
+
+    # Corrigir a linha e reprocessar (com falhas ainda ativas)
+    for entry in entries:
+        for step in entry['steps']:
+            for row in step['rows']:
+                row.pop('reject', None)
+    with open(dead_letter_path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+    with redirect_stdout(io.StringIO()):
+        assert writer.replay_dead_letters() == (1, 0)
+    assert not read_entries(dead_letter_path) and not os.path.exists(f"{dead_letter_path}.replaying")
+
+    # Repetir tudo: os ids determinísticos não criam duplicados
+    with redirect_stdout(io.StringIO()):
+        submit_all(reject=False)
+    expected_ids = {idempotency_key('clients', f"teste:{batch}:{i}", {}) for batch in range(40) for i in range(25)}
+    assert set(stored) == expected_ids, "linhas duplicadas ou em falta após repetir"
+    print(f"OK: repetições, dead-letter e reprocessamento ({server.stats['faults']} falhas injetadas)")
+    writer.close()
+    server.shutdown()
+
+
+def check_store_then_drop_is_idempotent(tmp: str):
+    # Só falhas "escrita feita, resposta perdida": as linhas são escritas mais do que uma vez
+    server, url = start_server(fault_rate=0.5, faults=['store_then_drop'])
+    writer = new_writer(url, os.path.join(tmp, 'store_then_drop.jsonl'))
+    with redirect_stdout(io.StringIO()):
+        for batch in range(20):
+            rows = [{'name': f"Idempotente {batch}-{i}", 'birth_date': '1900-01-01'} for i in range(10)]
+            writer.submit('clients', rows, [f"idempotente:{batch}:{i}" for i in range(10)])
+        writer.wait_all()
+    assert server.stats.get('store_then_drop', 0) > 0, "nenhuma resposta perdida"
+    assert server.stats['rows_posted'] > 200, "a escrita não foi repetida"
+    assert len(server.tables['clients']) == 200, "a escrita repetida criou duplicados"
+    print(f"OK: escrita repetida após resposta perdida não duplica ({server.stats['store_then_drop']} respostas perdidas)")
+    writer.close()
+    server.shutdown()
+
+
+def check_truncated_responses_are_retried(tmp: str):
+    server, url = start_server(fault_rate=0.0)
+    writer = new_writer(url, os.path.join(tmp, 'truncated.jsonl'))
+    original_request = writer.session.request
+    failures = [requests.exceptions.ChunkedEncodingError('corpo truncado')]
+
+    def request(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return original_request(*args, **kwargs)
+
+    writer.session.request = request
+    with redirect_stdout(io.StringIO()):
+        assert writer.select('clients', {'select': 'id'}) == []
+    assert not failures
+    print("OK: ChunkedEncodingError é repetido")
+    writer.close()
+    server.shutdown()
+
+
+def check_chains_and_existing_rows(tmp: str):
+    server, url = start_server()
+    dead_letter_path = os.path.join(tmp, 'chains.jsonl')
+    writer = new_writer(url, dead_letter_path)
+    server.tables['clients'] = {'cliente-existente': {'id': 'cliente-existente', 'name': 'Maria'}}
+
+    def chain(name: str, reject_appointment: bool):
+        client_step = writer.step('clients', [{'name': name, 'birth_date': '1900-01-01'}],
+                                  [f"drive:{name}"], skip_existing='name')
+        appointment = {'client_id': client_step['rows'][0]['id'], 'date': '2023-01-01T10:00:00'}
+        if reject_appointment:
+            appointment['reject'] = True
+        appointment_step = writer.step('appointments', [appointment], [f"drive:doc-{name}"])
+        note_step = writer.step('clinical_notes', [{'appointment_id': appointment_step['rows'][0]['id']}],
+                                [f"drive:doc-{name}"])
+        return writer.write_chain([client_step, appointment_step, note_step])
+
+    with redirect_stdout(io.StringIO()):
+        assert chain('Maria', reject_appointment=False)
+        assert not chain('Joana', reject_appointment=True)
+
+    # O cliente existente é reutilizado pela consulta
+    maria_appointment = server.tables['appointments'][idempotency_key('appointments', 'drive:doc-Maria', {})]
+    assert maria_appointment['client_id'] == 'cliente-existente'
+    assert len(server.tables['clients']) == 2
+
+    # A consulta rejeitada e a nota dependente ficam juntas no dead-letter
+    entries = read_entries(dead_letter_path)
+    assert [step['table'] for step in entries[0]['steps']] == ['appointments', 'clinical_notes']
+    entries[0]['steps'][0]['rows'][0].pop('reject')
+    with open(dead_letter_path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+    with redirect_stdout(io.StringIO()):
+        writer.replay_dead_letters()
+    assert len(server.tables['appointments']) == 2 and len(server.tables['clinical_notes']) == 2
+    print("OK: cadeias dependentes e clientes existentes")
+    writer.close()
+    server.shutdown()
+
+
+def check_split_counts_existing_rows_once(tmp: str):
+    server, url = start_server(fault_rate=0.0)
+    dead_letter_path = os.path.join(tmp, 'split.jsonl')
+    writer = new_writer(url, dead_letter_path)
+    server.tables['clients'] = {'cliente-existente': {'id': 'cliente-existente', 'name': 'Dividido 10'}}
+
+    rows = [{'name': f"Dividido {i}", 'birth_date': '1900-01-01'} for i in range(64)]
+    rows[40]['reject'] = True
+    output = io.StringIO()
+    with redirect_stdout(output):
+        writer.submit('clients', rows, [f"dividido:{i}" for i in range(64)], skip_existing='name')
+        writer.wait_all()
+    assert writer.counts('clients') == {'written': 62, 'failed': 1, 'skipped': 1}, writer.counts('clients')
+    assert output.getvalue().count('Já existe') == 1
+    entries = read_entries(dead_letter_path)
+    assert len(entries) == 1 and [row['name'] for row in entries[0]['steps'][0]['rows']] == ['Dividido 40']
+    print("OK: lote dividido conta os clientes existentes uma só vez")
+    writer.close()
+    server.shutdown()
+
+
+def check_batch_errors_are_not_split(tmp: str):
+    rows = [{'name': f"Lote {i}", 'birth_date': '1900-01-01', 'migration_source': 'sql:pacientes'}
+            for i in range(500)]
+
+    # Coluna migration_source inexistente (SQL não executado) e chave errada
+    for label, options, key in [('coluna desconhecida', {'columns': {'clients': ['id', 'name', 'birth_date']}},
+                                 'chave-de-teste'),
+                                ('chave errada', {'api_key': 'chave-certa'}, 'chave-de-teste')]:
+        server, url = start_server(fault_rate=0.0, **options)
+        dead_letter_path = os.path.join(tmp, f"{label.replace(' ', '-')}.jsonl")
+        writer = new_writer(url, dead_letter_path)
+        with redirect_stdout(io.StringIO()):
+            writer.submit('clients', [dict(row) for row in rows], [f"lote:{i}" for i in range(500)])
+            writer.wait_all()
+        entries = read_entries(dead_letter_path)
+        assert server.stats['requests'] == 1, f"{label}: {server.stats['requests']} pedidos"
+        assert len(entries) == 1 and len(entries[0]['steps'][0]['rows']) == 500, f"{label}: {len(entries)} entradas"
+        assert writer.counts('clients')['failed'] == 500
+        print(f"OK: {label} vai para o dead-letter numa só entrada, sem dividir o lote")
+        writer.close()
+        server.shutdown()
+
+
+def check_interrupted_replay_keeps_entries(tmp: str):
+    server, url = start_server(fault_rate=0.0)
+    dead_letter_path = os.path.join(tmp, 'interrupted.jsonl')
+    writer = new_writer(url, dead_letter_path)
+    for index in range(3):
+        writer.write_dead_letter([writer.step('clients', [{'name': f"P{index}", 'birth_date': '1900-01-01'}])], 'teste')
+
+    original_run_steps = writer._run_steps
+    calls = []
+
+    def interrupted(steps):
+        calls.append(steps)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return original_run_steps(steps)
+
+    writer._run_steps = interrupted
+    try:
+        with redirect_stdout(io.StringIO()):
+            writer.replay_dead_letters()
+    except KeyboardInterrupt:
+        pass
+    remaining = read_entries(dead_letter_path)
+    assert [entry['steps'][0]['rows'][0]['name'] for entry in remaining] == ['P1', 'P2'], remaining
+    assert not os.path.exists(f"{dead_letter_path}.replaying")
+    print("OK: reprocessamento interrompido mantém as entradas")
+    writer.close()
+    server.shutdown()
+
+
+def check_sql_migration_rerun(tmp: str):
+    server, url = start_server()
+    os.environ['NEXT_PUBLIC_SUPABASE_URL'] = url
+    os.environ['SUPABASE_SERVICE_ROLE_KEY'] = 'chave-de-teste'
+    import migrate_from_sql
+
+    db_path = os.path.join(tmp, 'legacy.db')
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE pacientes (id INTEGER PRIMARY KEY, nome TEXT, data_nascimento TEXT)")
+    connection.execute("CREATE TABLE consultas (paciente_id INTEGER, data_consulta TEXT, notas TEXT)")
+    connection.executemany("INSERT INTO pacientes (nome, data_nascimento) VALUES (?, ?)",
+                           [(f"Paciente {i}", '01/02/1980') for i in range(1200)])
+    connection.executemany("INSERT INTO consultas VALUES (?, ?, ?)",
+                           [(i % 1200, f"2023-03-{1 + i % 28:02d}", f"Consulta {i}") for i in range(1500)])
+    connection.commit()
+
+    def migrate():
+        migrator = migrate_from_sql.SQLToSupabaseMigrator(db_path)
+        migrator.writer.close()
+        migrator.writer = new_writer(url, os.path.join(tmp, 'sql.jsonl'))
+        with redirect_stdout(io.StringIO()):
+            migrator.connect_to_legacy_db()
+            migrator.migrate_clients()
+            migrator.migrate_appointments()
+            migrator.close_connection()
+
+    migrate()
+    appointments_before = dict(server.tables['appointments'])
+    assert len(server.tables['clients']) == 1200 and len(appointments_before) == 1500
+
+    # Apagar uma linha legacy no início da tabela não pode mudar as chaves das seguintes
+    connection.execute("DELETE FROM consultas WHERE rowid = 1")
+    connection.commit()
+    connection.close()
+    migrate()
+    assert len(server.tables['clients']) == 1200
+    assert server.tables['appointments'] == appointments_before, "as chaves das consultas mudaram"
+    print("OK: repetir a migração SQL não cria duplicados")
+    server.shutdown()
+
+
+def main():
+    """Função principal"""
+    with tempfile.TemporaryDirectory() as tmp:
+        check_retries_dead_letter_and_replay(tmp)
+        check_store_then_drop_is_idempotent(tmp)
+        check_truncated_responses_are_retried(tmp)
+        check_chains_and_existing_rows(tmp)
+        check_split_counts_existing_rows_once(tmp)
+        check_batch_errors_are_not_split(tmp)
+        check_interrupted_replay_keeps_entries(tmp)
+        check_sql_migration_rerun(tmp)
+    print("Todas as verificações passaram")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita a API REST do Supabase (PostgREST) e injeta falhas
+Serve para testar a camada de escrita (supabase_writer.py) sem tocar no Supabase real.
+Falhas injetadas aleatoriamente: 429 e 503, respostas mais lentas do que o timeout do
+cliente, ligações cortadas antes de processar o pedido e ligações cortadas depois de
+guardar as linhas (escrita feita mas resposta perdida, o caso que exige upserts idempotentes).
+As linhas aceites ficam em memória (upsert por id). Linhas com "reject": true são recusadas
+com 400, para testar o dead-letter; opcionalmente, chaves erradas (401) e colunas
+desconhecidas (400 PGRST204) imitam erros de configuração que afetam lotes inteiros.
+
+Uso:
+    python fault_server.py [porta] [taxa_de_falhas]
+    NEXT_PUBLIC_SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_ROLE_KEY=test python migrate_from_sql.py
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_PORT = 54321
+
+# Maior do que o timeout por omissão do SupabaseWriter (30 s)
+DEFAULT_SLOW_DELAY = 35.0
+
+FAULTS = ['429', '503', 'slow', 'drop', 'store_then_drop']
+
+# Parâmetros da query que não são filtros de colunas
+RESERVED_PARAMS = {'select', 'order', 'limit', 'columns'}
+
+
+def parse_in_list(value: str) -> List[str]:
+    """Lê a lista de um filtro in.("a","b",c), com aspas e barras invertidas como no PostgREST"""
+    items = []
+    current = ''
+    quoted = False
+    escaped = False
+    for char in value:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == ',' and not quoted:
+            items.append(current)
+            current = ''
+        else:
+            current += char
+    items.append(current)
+    return items
+
+
+def matches_filter(row: Dict[str, Any], column: str, condition: str) -> bool:
+    """Aplica um filtro PostgREST simples (eq, gt, gte, lt, in) a uma linha"""
+    operator, value = condition.split('.', 1)
+    current = row.get(column)
+    if operator == 'in':
+        return current is not None and str(current) in parse_in_list(value[1:-1])
+    if current is None:
+        return False
+    current = str(current)
+    return {
+        'eq': current == value,
+        'gt': current > value,
+        'gte': current >= value,
+        'lt': current < value
+    }[operator]
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para permitir ligações keep-alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def table_name(self) -> str:
+        return urlparse(self.path).path.rsplit('/', 1)[-1]
+
+    def authorized(self) -> bool:
+        """Recusa (401) pedidos com uma chave diferente da configurada, como a API do Supabase"""
+        if self.server.api_key is None or self.headers.get('apikey') == self.server.api_key:
+            return True
+        self.send_json(401, {'message': 'Invalid API key'})
+        return False
+
+    def send_json(self, status: int, body, headers: Dict[str, str] = None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        if data:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def inject_fault(self, store: Optional[Callable[[], None]] = None) -> bool:
+        """Aplica uma falha aleatória; devolve True se o pedido não deve ser processado"""
+        if random.random() >= self.server.fault_rate:
+            return False
+
+        fault = random.choice(self.server.faults)
+        with self.server.lock:
+            self.server.stats['faults'] += 1
+            self.server.stats[fault] = self.server.stats.get(fault, 0) + 1
+        if fault == '429':
+            self.send_json(429, {'message': 'Too Many Requests'}, {'Retry-After': '0'})
+        elif fault == '503':
+            self.send_json(503, {'message': 'Service Unavailable'})
+        elif fault == 'slow':
+            time.sleep(self.server.slow_delay)
+            self.close_connection = True
+        elif fault == 'store_then_drop' and store is not None:
+            # A escrita fica feita, mas o cliente nunca recebe a resposta
+            store()
+            self.close_connection = True
+        else:
+            self.close_connection = True
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        rows = json.loads(self.rfile.read(length) or b'[]')
+        if isinstance(rows, dict):
+            rows = [rows]
+
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+        if not self.authorized():
+            return
+
+        # Funções SQL (/rpc/...) não existem neste servidor
+        if '/rpc/' in self.path:
+            if not self.inject_fault():
+                self.send_json(404, {'message': 'Função não encontrada'})
+            return
+
+        table = self.table_name()
+        known_columns = self.server.columns.get(table)
+        for row in rows:
+            if 'id' not in row:
+                self.send_json(400, {'code': '23502', 'message': 'Linha sem id'})
+                return
+            unknown = [column for column in row if known_columns is not None and column not in known_columns]
+            if unknown:
+                # Erro de schema do PostgREST: afeta o lote inteiro, não uma linha
+                self.send_json(400, {'code': 'PGRST204', 'message': f"Could not find the '{unknown[0]}' column "
+                                                                    f"of '{table}' in the schema cache"})
+                return
+            if row.get('reject'):
+                self.send_json(400, {'code': '23514', 'message': f"Linha rejeitada: {row['id']}"})
+                return
+
+        def store():
+            with self.server.lock:
+                stored = self.server.tables.setdefault(table, {})
+                for row in rows:
+                    stored[row['id']] = row
+                self.server.stats['rows_posted'] += len(rows)
+
+        if self.inject_fault(store):
+            return
+
+        store()
+        if 'return=minimal' in self.headers.get('Prefer', ''):
+            self.send_json(201, None)
+        else:
+            self.send_json(201, rows)
+
+    def do_GET(self):
+        """Suporta os filtros PostgREST usados pelos scripts: select, order=id, limit, coluna=eq/gt/gte/lt/in"""
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+        if not self.authorized():
+            return
+
+        if self.inject_fault():
+            return
+
+        with self.server.lock:
+            rows = list(self.server.tables.get(self.table_name(), {}).values())
+
+        query = parse_qs(urlparse(self.path).query)
+        for column, conditions in query.items():
+            if column in RESERVED_PARAMS:
+                continue
+            for condition in conditions:
+                rows = [row for row in rows if matches_filter(row, column, condition)]
+        if 'order' in query:
+            rows.sort(key=lambda row: row['id'])
+        if 'limit' in query:
+            rows = rows[:int(query['limit'][0])]
+        if 'select' in query:
+            columns = query['select'][0].split(',')
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        self.send_json(200, rows)
+
+
+class FaultServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clientes que desistem do pedido (timeout) são esperados; outros erros são mostrados
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def create_server(port: int = DEFAULT_PORT, fault_rate: float = 0.3,
+                  slow_delay: float = DEFAULT_SLOW_DELAY,
+                  faults: Optional[List[str]] = None, api_key: Optional[str] = None,
+                  columns: Optional[Dict[str, List[str]]] = None) -> ThreadingHTTPServer:
+    """Cria o servidor (sem o iniciar); port=0 escolhe uma porta livre
+
+    slow_delay deve ser maior do que o timeout do cliente, para que a falha "slow" dê timeout.
+    faults limita as falhas injetadas (por omissão, todas as de FAULTS).
+    api_key, se indicada, é exigida no cabeçalho apikey (401 caso contrário).
+    columns, se indicado, lista as colunas de cada tabela; colunas desconhecidas dão o erro PGRST204.
+    """
+    server = FaultServer(('127.0.0.1', port), FaultInjectingHandler)
+    server.fault_rate = fault_rate
+    server.slow_delay = slow_delay
+    server.faults = faults or FAULTS
+    server.api_key = api_key
+    server.columns = columns or {}
+    server.lock = threading.Lock()
+    server.tables = {}
+    server.stats = {'connections': 0, 'requests': 0, 'faults': 0, 'rows_posted': 0}
+    return server
+
+
+def main():
+    """Função principal"""
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    fault_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+
+    server = create_server(port, fault_rate)
+    print(f"Servidor com falhas injetadas em http://127.0.0.1:{port} (taxa de falhas: {fault_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Estatísticas: {server.stats}")
+        for table, rows in server.tables.items():
+            print(f"{table}: {len(rows)} linhas")
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,11 @@ from typing import List, Dict, Optional
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from supabase import create_client, Client
+import httplib2
+from supabase_writer import SupabaseWriter
+from migration_records import ClientRecord, AppointmentRecord, ClinicalNoteRecord
 import pickle
 
 # Configurações
@@ -21,11 +24,14 @@ SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 
+# Valor da coluna migration_source nas linhas criadas por este script
+MIGRATION_SOURCE = 'drive'
+
 class DriveToSupabaseMigrator:
     def __init__(self):
         self.drive_service = None
         self.docs_service = None
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self.writer = SupabaseWriter(SUPABASE_URL, SUPABASE_KEY)
         
     def authenticate_google(self):
         """Autentica com a API do Google Drive"""
@@ -49,8 +55,10 @@ class DriveToSupabaseMigrator:
             with open('token.pickle', 'wb') as token:
                 pickle.dump(creds, token)
         
-        self.drive_service = build('drive', 'v3', credentials=creds)
-        self.docs_service = build('docs', 'v1', credentials=creds)
+        # Uma única ligação HTTP autenticada (keep-alive) partilhada pelos dois serviços
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=60))
+        self.drive_service = build('drive', 'v3', http=http)
+        self.docs_service = build('docs', 'v1', http=http)
     
     def list_patient_documents(self, folder_id: str) -> List[Dict]:
         """Lista todos os documentos na pasta de pacientes"""
@@ -100,20 +108,16 @@ class DriveToSupabaseMigrator:
         
         return text
     
-    def parse_patient_info(self, filename: str, content: str) -> Optional[Dict]:
+    def parse_patient_info(self, filename: str, content: str) -> Optional[ClientRecord]:
         """Extrai informações do paciente do conteúdo do documento"""
-        patient_info = {
-            'name': '',
-            'birth_date': None,
-            'email': None,
-            'phone': None,
-            'notes': content[:1000] if content else None  # Primeiros 1000 caracteres como notas
-        }
-        
         # Tentar extrair nome do arquivo
         # Assumir formato "Nome do Paciente.docx" ou similar
         name_from_file = re.sub(r'\.(docx?|gdoc)$', '', filename, flags=re.IGNORECASE)
-        patient_info['name'] = name_from_file
+        patient_info = ClientRecord(
+            name_from_file,
+            notes=content[:1000] if content else None,  # Primeiros 1000 caracteres como notas
+            migration_source=MIGRATION_SOURCE
+        )
         
         # Procurar por padrões no conteúdo
         patterns = {
@@ -142,94 +146,96 @@ class DriveToSupabaseMigrator:
                         # Converter para formato ISO
                         try:
                             date_obj = datetime.strptime(value.replace('-', '/'), '%d/%m/%Y')
-                            patient_info[field] = date_obj.strftime('%Y-%m-%d')
+                            setattr(patient_info, field, date_obj.strftime('%Y-%m-%d'))
                         except:
                             continue
                     else:
-                        patient_info[field] = value
+                        setattr(patient_info, field, value)
                     break
         
         # Validar se temos informação mínima
-        if not patient_info['name'] or len(patient_info['name']) < 2:
+        if not patient_info.name or len(patient_info.name) < 2:
             return None
             
         return patient_info
     
-    def create_client_in_supabase(self, client_data: Dict) -> Optional[str]:
-        """Cria um cliente no Supabase e retorna o ID"""
-        try:
-            result = self.supabase.table('clients').insert(client_data).execute()
-            if result.data:
-                client_id = result.data[0]['id']
-                print(f"Cliente criado: {client_data['name']} (ID: {client_id})")
-                return client_id
-            return None
-            
-        except Exception as e:
-            print(f"Erro ao criar cliente {client_data['name']}: {e}")
-            return None
+    def document_date(self, doc: Dict) -> str:
+        """Data por omissão da consulta: criação do documento no Drive (não muda entre execuções)"""
+        return doc.get('createdTime') or doc.get('modifiedTime') or '1900-01-01T10:00:00'
     
-    def create_appointment_record(self, client_id: str, filename: str, content: str):
-        """Cria um registo de consulta baseado no documento"""
-        try:
-            # Tentar extrair data do conteúdo ou usar data de modificação do arquivo
-            appointment_data = {
-                'client_id': client_id,
-                'doctor_id': None,  # Será necessário configurar manualmente
-                'room_id': None,    # Será necessário configurar manualmente
-                'date': datetime.now().isoformat(),  # Data padrão
-                'duration_min': 60,  # Duração padrão
-                'status': 'done',
-                'notes': f"Importado de: {filename}"
-            }
-            
-            # Procurar por datas no conteúdo
-            date_patterns = [
-                r'(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})',
-                r'(\d{4}[\/\-]\d{1,2}[\/\-]\d{1,2})'
-            ]
-            
-            for pattern in date_patterns:
-                matches = re.findall(pattern, content)
-                if matches:
-                    try:
-                        # Usar a primeira data encontrada
-                        date_str = matches[0]
-                        if '/' in date_str or '-' in date_str:
-                            separator = '/' if '/' in date_str else '-'
-                            parts = date_str.split(separator)
-                            if len(parts) == 3:
-                                # Assumir dd/mm/yyyy ou yyyy/mm/dd
-                                if len(parts[0]) == 4:
-                                    # yyyy/mm/dd
-                                    date_obj = datetime(int(parts[0]), int(parts[1]), int(parts[2]))
-                                else:
-                                    # dd/mm/yyyy
-                                    date_obj = datetime(int(parts[2]), int(parts[1]), int(parts[0]))
-                                appointment_data['date'] = date_obj.isoformat()
-                                break
-                    except:
-                        continue
-            
-            # Criar consulta
-            result = self.supabase.table('appointments').insert(appointment_data).execute()
-            if result.data:
-                appointment_id = result.data[0]['id']
-                print(f"Consulta criada para cliente {client_id}")
-                
-                # Criar nota clínica
-                clinical_note = {
-                    'appointment_id': appointment_id,
-                    'summary': content[:500] if content else None,
-                    'diagnosis': None,
-                    'prescription': None
-                }
-                
-                self.supabase.table('clinical_notes').insert(clinical_note).execute()
-                print(f"Nota clínica criada para consulta {appointment_id}")
-                
-        except Exception as e:
-            print(f"Erro ao criar consulta para cliente {client_id}: {e}")
+    def build_appointment_record(self, client_id: str, filename: str, content: str,
+                                 default_date: str) -> AppointmentRecord:
+        """Constrói o registo de consulta baseado no documento"""
+        # Tentar extrair data do conteúdo ou usar a data de criação do arquivo
+        # doctor_id e room_id serão necessários configurar manualmente
+        appointment_record = AppointmentRecord(
+            default_date,  # Data padrão
+            client_id=client_id,
+            duration_min=60,  # Duração padrão
+            status='done',
+            notes=f"Importado de: {filename}",
+            migration_source=MIGRATION_SOURCE
+        )
+        
+        # Procurar por datas no conteúdo
+        date_patterns = [
+            r'(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{4})',
+            r'(\d{4}[\/\-]\d{1,2}[\/\-]\d{1,2})'
+        ]
+        
+        for pattern in date_patterns:
+            matches = re.findall(pattern, content)
+            if matches:
+                try:
+                    # Usar a primeira data encontrada
+                    date_str = matches[0]
+                    if '/' in date_str or '-' in date_str:
+                        separator = '/' if '/' in date_str else '-'
+                        parts = date_str.split(separator)
+                        if len(parts) == 3:
+                            # Assumir dd/mm/yyyy ou yyyy/mm/dd
+                            if len(parts[0]) == 4:
+                                # yyyy/mm/dd
+                                date_obj = datetime(int(parts[0]), int(parts[1]), int(parts[2]))
+                            else:
+                                # dd/mm/yyyy
+                                date_obj = datetime(int(parts[2]), int(parts[1]), int(parts[0]))
+                            appointment_record.date = date_obj.isoformat()
+                            break
+                except:
+                    continue
+        
+        return appointment_record
+    
+    def migrate_document(self, doc: Dict, content: str, patient_info: ClientRecord) -> bool:
+        """Escreve cliente, consulta e nota clínica de um documento como uma só cadeia
+
+        Se um dos passos falhar definitivamente, o passo e os seguintes vão juntos para o
+        dead-letter, para que o reprocessamento recrie a consulta e a nota dependentes.
+        """
+        # Cliente (saltado se já existir um com o mesmo nome; a consulta passa a apontar para ele)
+        client_step = self.writer.step('clients', [patient_info.to_payload()],
+                                       [f"drive:{patient_info.name}"], skip_existing='name')
+        client_id = client_step['rows'][0]['id']
+        
+        # O id do documento identifica a consulta/nota entre execuções (idempotência)
+        source_key = f"drive:{doc['id']}"
+        appointment_record = self.build_appointment_record(client_id, doc['name'], content, self.document_date(doc))
+        appointment_step = self.writer.step('appointments', [appointment_record.to_payload()], [source_key])
+        appointment_id = appointment_step['rows'][0]['id']
+        
+        # Nota clínica
+        clinical_note = ClinicalNoteRecord(
+            appointment_id,
+            summary=content[:500] if content else None
+        )
+        note_step = self.writer.step('clinical_notes', [clinical_note.to_payload()], [source_key])
+        
+        if not self.writer.write_chain([client_step, appointment_step, note_step]):
+            return False
+        
+        print(f"Cliente, consulta e nota clínica migrados: {patient_info.name} (consulta {appointment_id})")
+        return True
     
     def migrate_folder(self, folder_id: str):
         """Migra todos os documentos de uma pasta"""
@@ -255,21 +261,10 @@ class DriveToSupabaseMigrator:
                     errors_count += 1
                     continue
                 
-                # Verificar se cliente já existe
-                existing = self.supabase.table('clients').select('id').eq('name', patient_info['name']).execute()
-                
-                if existing.data:
-                    client_id = existing.data[0]['id']
-                    print(f"Cliente já existe: {patient_info['name']}")
-                else:
-                    # Criar cliente
-                    client_id = self.create_client_in_supabase(patient_info)
-                    if not client_id:
-                        errors_count += 1
-                        continue
-                
-                # Criar registo de consulta
-                self.create_appointment_record(client_id, doc['name'], content)
+                # Criar cliente (se ainda não existir), consulta e nota clínica
+                if not self.migrate_document(doc, content, patient_info):
+                    errors_count += 1
+                    continue
                 
                 migrated_count += 1
                 
@@ -280,6 +275,8 @@ class DriveToSupabaseMigrator:
         print(f"\n=== Migração Concluída ===")
         print(f"Documentos processados: {migrated_count}")
         print(f"Erros: {errors_count}")
+        if errors_count:
+            print(f"Documentos com falhas de escrita ficam em {self.writer.dead_letter_path}")
 
 def main():
     """Função principal"""
@@ -300,7 +297,10 @@ def main():
     migrator.authenticate_google()
     
     print("Iniciando migração...")
-    migrator.migrate_folder(FOLDER_ID)
+    try:
+        migrator.migrate_folder(FOLDER_ID)
+    finally:
+        migrator.writer.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -10,16 +10,24 @@ import json
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 import pandas as pd
-from supabase import create_client, Client
+from supabase_writer import SupabaseWriter
+from migration_records import (
+    ClientRecord, AppointmentRecord, DEFAULT_BATCH_SIZE, build_batch_payload, iter_table_batches,
+    primary_key_columns, row_source_key, table_columns, count_rows
+)
 
 # Configurações
 SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 
+# Possíveis nomes das tabelas na base de dados legacy
+CLIENT_TABLES = ['clients', 'patients', 'pacientes', 'clientes']
+APPOINTMENT_TABLES = ['appointments', 'consultas', 'sessions', 'visits']
+
 class SQLToSupabaseMigrator:
     def __init__(self, db_path: str):
         self.db_path = db_path
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self.writer = SupabaseWriter(SUPABASE_URL, SUPABASE_KEY)
         self.connection = None
         
     def connect_to_legacy_db(self):
@@ -65,19 +73,41 @@ class SQLToSupabaseMigrator:
             print(f"Erro ao listar tabelas: {e}")
             return []
     
+    def find_table(self, possible_tables: List[str]) -> Optional[str]:
+        """Devolve a primeira tabela da lista que existe na base de dados legacy"""
+        tables = self.list_tables()
+        for table in possible_tables:
+            if table in tables:
+                return table
+        return None
+    
+    def migration_source(self, legacy_table: str) -> str:
+        """Valor da coluna migration_source nas linhas migradas a partir de uma tabela legacy"""
+        return f"sql:{legacy_table}"
+    
+    def client_source_key(self, client_table: str, name: str) -> str:
+        """Chave de origem de um cliente (o nome identifica o cliente entre execuções)"""
+        return f"{client_table}:{name}"
+    
+    def appointment_source_key(self, appointment_table: str, row_key: str) -> str:
+        """Chave de origem de uma consulta (a chave primária, ou rowid, da linha legacy)"""
+        return f"{appointment_table}:{row_key}"
+    
+    def appointment_key_columns(self, appointment_table: str) -> List[str]:
+        """Colunas que identificam uma consulta legacy entre execuções (avisa se só houver rowid)"""
+        key_columns = primary_key_columns(self.connection, appointment_table)
+        if key_columns == ['rowid']:
+            print(f"Aviso: a tabela {appointment_table} não tem chave primária; as consultas são identificadas "
+                  f"pelo rowid, que o SQLite pode renumerar (ex.: VACUUM). Se a base legacy for compactada "
+                  f"entre execuções, repetir a migração cria as consultas em duplicado.")
+        return key_columns
+    
     def migrate_clients(self):
         """Migra dados de clientes/pacientes"""
         print("\n=== Migrando Clientes ===")
         
         # Mapear possíveis nomes de tabelas
-        possible_tables = ['clients', 'patients', 'pacientes', 'clientes']
-        client_table = None
-        
-        tables = self.list_tables()
-        for table in possible_tables:
-            if table in tables:
-                client_table = table
-                break
+        client_table = self.find_table(CLIENT_TABLES)
         
         if not client_table:
             print("Tabela de clientes não encontrada")
@@ -86,45 +116,47 @@ class SQLToSupabaseMigrator:
         print(f"Tabela de clientes encontrada: {client_table}")
         
         try:
-            # Ler dados da tabela
-            df = pd.read_sql_query(f"SELECT * FROM {client_table}", self.connection)
-            print(f"Encontrados {len(df)} registos na tabela {client_table}")
+            # Ler dados da tabela em lotes (sem DataFrame completo em memória)
+            print(f"Encontrados {count_rows(self.connection, client_table)} registos na tabela {client_table}")
             
             # Mapear colunas para o schema do Supabase
-            column_mapping = self.map_client_columns(df.columns.tolist())
+            column_mapping = self.map_client_columns(table_columns(self.connection, client_table))
             
-            migrated_count = 0
             errors_count = 0
+            seen_names = set()
+            counts_before = self.writer.counts('clients')
             
-            for _, row in df.iterrows():
-                try:
-                    # Transformar dados
-                    client_data = self.transform_client_data(row, column_mapping)
+            for rows in iter_table_batches(self.connection, client_table, DEFAULT_BATCH_SIZE):
+                # Transformar dados
+                batch: Dict[str, ClientRecord] = {}
+                for row in rows:
+                    client_record = self.transform_client_data(row, column_mapping)
                     
-                    if not client_data:
+                    if not client_record:
                         errors_count += 1
                         continue
                     
-                    # Verificar se cliente já existe
-                    existing = self.supabase.table('clients').select('id').eq('name', client_data['name']).execute()
-                    
-                    if existing.data:
-                        print(f"Cliente já existe: {client_data['name']}")
+                    if client_record.name in seen_names:
+                        print(f"Cliente já existe: {client_record.name}")
                         continue
-                    
-                    # Inserir no Supabase
-                    result = self.supabase.table('clients').insert(client_data).execute()
-                    
-                    if result.data:
-                        migrated_count += 1
-                        print(f"Cliente migrado: {client_data['name']}")
-                    else:
-                        errors_count += 1
-                        
-                except Exception as e:
-                    print(f"Erro ao migrar cliente: {e}")
-                    errors_count += 1
+                    seen_names.add(client_record.name)
+                    client_record.migration_source = self.migration_source(client_table)
+                    batch[client_record.name] = client_record
+                
+                if not batch:
+                    continue
+                
+                # Inserir lote no Supabase, saltando os clientes que já existem (com repetições;
+                # falhas definitivas, incluindo a verificação de existência, vão para o dead-letter)
+                source_keys = [self.client_source_key(client_table, name) for name in batch]
+                self.writer.submit('clients', build_batch_payload(batch.values()), source_keys, skip_existing='name')
+            
+            self.writer.wait_all()
+            counts_after = self.writer.counts('clients')
+            migrated_count = counts_after['written'] - counts_before['written']
+            errors_count += counts_after['failed'] - counts_before['failed']
             
+            print(f"Clientes já existentes: {counts_after['skipped'] - counts_before['skipped']}")
             print(f"Clientes migrados: {migrated_count}")
             print(f"Erros: {errors_count}")
             return True
@@ -161,41 +193,39 @@ class SQLToSupabaseMigrator:
         print(f"Mapeamento de colunas: {mapping}")
         return mapping
     
-    def transform_client_data(self, row: pd.Series, mapping: Dict[str, str]) -> Optional[Dict]:
+    def transform_client_data(self, row: sqlite3.Row, mapping: Dict[str, str]) -> Optional[ClientRecord]:
         """Transforma dados de um cliente para o formato do Supabase"""
         try:
             # Nome é obrigatório
             if 'name' not in mapping or pd.isna(row[mapping['name']]):
                 return None
             
-            client_data = {
-                'name': str(row[mapping['name']]).strip()
-            }
+            client_record = ClientRecord(str(row[mapping['name']]).strip())
             
             # Data de nascimento (obrigatória)
             if 'birth_date' in mapping and not pd.isna(row[mapping['birth_date']]):
                 birth_date = self.parse_date(row[mapping['birth_date']])
                 if birth_date:
-                    client_data['birth_date'] = birth_date
+                    client_record.birth_date = birth_date
                 else:
                     # Se não conseguir parsear a data, usar uma data padrão
-                    client_data['birth_date'] = '1900-01-01'
+                    client_record.birth_date = '1900-01-01'
             else:
-                client_data['birth_date'] = '1900-01-01'
+                client_record.birth_date = '1900-01-01'
             
             # Campos opcionais
             if 'email' in mapping and not pd.isna(row[mapping['email']]):
                 email = str(row[mapping['email']]).strip()
                 if '@' in email:  # Validação básica
-                    client_data['email'] = email
+                    client_record.email = email
             
             if 'phone' in mapping and not pd.isna(row[mapping['phone']]):
-                client_data['phone'] = str(row[mapping['phone']]).strip()
+                client_record.phone = str(row[mapping['phone']]).strip()
             
             if 'notes' in mapping and not pd.isna(row[mapping['notes']]):
-                client_data['notes'] = str(row[mapping['notes']]).strip()
+                client_record.notes = str(row[mapping['notes']]).strip()
             
-            return client_data
+            return client_record
             
         except Exception as e:
             print(f"Erro ao transformar dados do cliente: {e}")
@@ -232,14 +262,7 @@ class SQLToSupabaseMigrator:
         """Migra dados de consultas"""
         print("\n=== Migrando Consultas ===")
         
-        possible_tables = ['appointments', 'consultas', 'sessions', 'visits']
-        appointment_table = None
-        
-        tables = self.list_tables()
-        for table in possible_tables:
-            if table in tables:
-                appointment_table = table
-                break
+        appointment_table = self.find_table(APPOINTMENT_TABLES)
         
         if not appointment_table:
             print("Tabela de consultas não encontrada")
@@ -248,34 +271,37 @@ class SQLToSupabaseMigrator:
         print(f"Tabela de consultas encontrada: {appointment_table}")
         
         try:
-            df = pd.read_sql_query(f"SELECT * FROM {appointment_table}", self.connection)
-            print(f"Encontrados {len(df)} registos na tabela {appointment_table}")
+            print(f"Encontrados {count_rows(self.connection, appointment_table)} registos na tabela {appointment_table}")
             
-            column_mapping = self.map_appointment_columns(df.columns.tolist())
+            column_mapping = self.map_appointment_columns(table_columns(self.connection, appointment_table))
             
-            migrated_count = 0
             errors_count = 0
+            counts_before = self.writer.counts('appointments')
+            key_columns = self.appointment_key_columns(appointment_table)
             
-            for _, row in df.iterrows():
-                try:
-                    appointment_data = self.transform_appointment_data(row, column_mapping)
+            for rows in iter_table_batches(self.connection, appointment_table, DEFAULT_BATCH_SIZE, key_columns):
+                batch: List[AppointmentRecord] = []
+                source_keys: List[str] = []
+                for row in rows:
+                    appointment_record = self.transform_appointment_data(row, column_mapping)
                     
-                    if not appointment_data:
+                    if not appointment_record:
                         errors_count += 1
                         continue
-                    
-                    # Inserir consulta
-                    result = self.supabase.table('appointments').insert(appointment_data).execute()
-                    
-                    if result.data:
-                        migrated_count += 1
-                        print(f"Consulta migrada: {appointment_data.get('date', 'sem data')}")
-                    else:
-                        errors_count += 1
-                        
-                except Exception as e:
-                    print(f"Erro ao migrar consulta: {e}")
-                    errors_count += 1
+                    appointment_record.migration_source = self.migration_source(appointment_table)
+                    batch.append(appointment_record)
+                    source_keys.append(self.appointment_source_key(appointment_table, row_source_key(row, key_columns)))
+                
+                if not batch:
+                    continue
+                
+                # Inserir lote de consultas (com repetições; falhas definitivas vão para o dead-letter)
+                self.writer.submit('appointments', build_batch_payload(batch), source_keys)
+            
+            self.writer.wait_all()
+            counts_after = self.writer.counts('appointments')
+            migrated_count = counts_after['written'] - counts_before['written']
+            errors_count += counts_after['failed'] - counts_before['failed']
             
             print(f"Consultas migradas: {migrated_count}")
             print(f"Erros: {errors_count}")
@@ -307,29 +333,24 @@ class SQLToSupabaseMigrator:
         print(f"Mapeamento de consultas: {mapping}")
         return mapping
     
-    def transform_appointment_data(self, row: pd.Series, mapping: Dict[str, str]) -> Optional[Dict]:
+    def transform_appointment_data(self, row: sqlite3.Row, mapping: Dict[str, str]) -> Optional[AppointmentRecord]:
         """Transforma dados de consulta para o formato do Supabase"""
         try:
-            appointment_data = {
-                'client_id': None,  # Será necessário mapear manualmente
-                'doctor_id': None,  # Será necessário configurar
-                'room_id': None,    # Será necessário configurar
-                'date': datetime.now().isoformat(),
-                'duration_min': 60,
-                'status': 'done'
-            }
+            # client_id, doctor_id e room_id serão necessários mapear/configurar manualmente
+            # Sem data na tabela legacy: data fixa (como birth_date), para o resultado não depender do dia da migração
+            appointment_record = AppointmentRecord('1900-01-01T10:00:00', duration_min=60, status='done')
             
             # Data da consulta
             if 'date' in mapping and not pd.isna(row[mapping['date']]):
                 date_parsed = self.parse_date(row[mapping['date']])
                 if date_parsed:
-                    appointment_data['date'] = f"{date_parsed}T10:00:00"
+                    appointment_record.date = f"{date_parsed}T10:00:00"
             
             # Notas
             if 'notes' in mapping and not pd.isna(row[mapping['notes']]):
-                appointment_data['notes'] = str(row[mapping['notes']]).strip()
+                appointment_record.notes = str(row[mapping['notes']]).strip()
             
-            return appointment_data
+            return appointment_record
             
         except Exception as e:
             print(f"Erro ao transformar dados da consulta: {e}")
@@ -353,8 +374,14 @@ class SQLToSupabaseMigrator:
             except Exception as e:
                 print(f"Erro ao exportar {table}: {e}")
     
+    def replay_dead_letters(self):
+        """Reenvia os lotes que falharam definitivamente numa execução anterior"""
+        print(f"\n=== Reprocessando {self.writer.dead_letter_path} ===")
+        self.writer.replay_dead_letters()
+    
     def close_connection(self):
-        """Fecha a conexão com a base de dados"""
+        """Fecha a conexão com a base de dados e as ligações ao Supabase"""
+        self.writer.close()
         if self.connection:
             self.connection.close()
 
@@ -384,8 +411,9 @@ def main():
         print("1. Migrar dados para Supabase")
         print("2. Exportar dados para CSV")
         print("3. Ambos")
+        print("4. Reprocessar lotes falhados (dead-letter)")
         
-        choice = input("Escolha uma opção (1/2/3): ").strip()
+        choice = input("Escolha uma opção (1/2/3/4): ").strip()
         
         if choice in ['1', '3']:
             print("\nIniciando migração para Supabase...")
@@ -396,6 +424,9 @@ def main():
             print("\nExportando para CSV...")
             migrator.export_to_csv()
         
+        if choice == '4':
+            migrator.replay_dead_letters()
+        
         print("\n=== Processo Concluído ===")
         
     finally:
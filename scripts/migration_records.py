@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Registos compactos usados pelos scripts de migração
+Cada linha migrada (cliente, consulta, nota clínica) é representada por um objeto
+com __slots__, sem dicionário por instância, e só é convertida em dicionário no
+momento de construir o payload do lote enviado ao Supabase.
+"""
+
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+# Número de linhas lidas da base de dados / enviadas ao Supabase de cada vez
+DEFAULT_BATCH_SIZE = 500
+
+
+class ClientRecord:
+    """Linha da tabela clients"""
+    __slots__ = ('name', 'birth_date', 'email', 'phone', 'notes', 'migration_source')
+
+    def __init__(self, name: str, birth_date: Optional[str] = None, email: Optional[str] = None,
+                 phone: Optional[str] = None, notes: Optional[str] = None,
+                 migration_source: Optional[str] = None):
+        self.name = name
+        self.birth_date = birth_date
+        self.email = email
+        self.phone = phone
+        self.notes = notes
+        self.migration_source = migration_source
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Converte para o formato aceite pelo Supabase (omite campos opcionais vazios)"""
+        payload = {'name': self.name, 'birth_date': self.birth_date}
+        if self.email is not None:
+            payload['email'] = self.email
+        if self.phone is not None:
+            payload['phone'] = self.phone
+        if self.notes is not None:
+            payload['notes'] = self.notes
+        if self.migration_source is not None:
+            payload['migration_source'] = self.migration_source
+        return payload
+
+    def __repr__(self) -> str:
+        return f"ClientRecord(name={self.name!r}, birth_date={self.birth_date!r})"
+
+
+class AppointmentRecord:
+    """Linha da tabela appointments"""
+    __slots__ = ('client_id', 'doctor_id', 'room_id', 'date', 'duration_min', 'status', 'notes',
+                 'migration_source')
+
+    def __init__(self, date: str, client_id: Optional[str] = None, doctor_id: Optional[str] = None,
+                 room_id: Optional[str] = None, duration_min: int = 60, status: str = 'done',
+                 notes: Optional[str] = None, migration_source: Optional[str] = None):
+        self.client_id = client_id
+        self.doctor_id = doctor_id
+        self.room_id = room_id
+        self.date = date
+        self.duration_min = duration_min
+        self.status = status
+        self.notes = notes
+        self.migration_source = migration_source
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Converte para o formato aceite pelo Supabase"""
+        payload = {
+            'client_id': self.client_id,
+            'doctor_id': self.doctor_id,
+            'room_id': self.room_id,
+            'date': self.date,
+            'duration_min': self.duration_min,
+            'status': self.status
+        }
+        if self.notes is not None:
+            payload['notes'] = self.notes
+        if self.migration_source is not None:
+            payload['migration_source'] = self.migration_source
+        return payload
+
+    def __repr__(self) -> str:
+        return f"AppointmentRecord(client_id={self.client_id!r}, date={self.date!r})"
+
+
+class ClinicalNoteRecord:
+    """Linha da tabela clinical_notes"""
+    __slots__ = ('appointment_id', 'summary', 'diagnosis', 'prescription')
+
+    def __init__(self, appointment_id: Optional[str], summary: Optional[str] = None,
+                 diagnosis: Optional[str] = None, prescription: Optional[str] = None):
+        self.appointment_id = appointment_id
+        self.summary = summary
+        self.diagnosis = diagnosis
+        self.prescription = prescription
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Converte para o formato aceite pelo Supabase"""
+        return {
+            'appointment_id': self.appointment_id,
+            'summary': self.summary,
+            'diagnosis': self.diagnosis,
+            'prescription': self.prescription
+        }
+
+    def __repr__(self) -> str:
+        return f"ClinicalNoteRecord(appointment_id={self.appointment_id!r})"
+
+
+def build_batch_payload(records: Iterable) -> List[Dict[str, Any]]:
+    """Constrói o payload de um lote diretamente a partir dos registos"""
+    return [record.to_payload() for record in records]
+
+
+def primary_key_columns(connection: sqlite3.Connection, table_name: str) -> List[str]:
+    """Colunas da chave primária de uma tabela (rowid se a tabela não tiver chave primária)
+
+    Numa tabela sem chave primária o rowid não é estável: o SQLite pode renumerá-lo (ex.: VACUUM).
+    """
+    columns = [(info[5], info[1]) for info in connection.execute(f"PRAGMA table_info({table_name})") if info[5]]
+    return [name for _, name in sorted(columns)] or ['rowid']
+
+
+def iter_table_batches(connection: sqlite3.Connection, table_name: str,
+                       batch_size: int = DEFAULT_BATCH_SIZE,
+                       key_columns: Optional[List[str]] = None) -> Iterator[Sequence[sqlite3.Row]]:
+    """Lê uma tabela em lotes com fetchmany, sem carregar a tabela inteira em memória
+
+    Com key_columns, cada linha inclui também essas colunas como __key_0, __key_1, ...
+    (ver row_source_key) e a leitura é ordenada por elas.
+    """
+    if key_columns:
+        quoted = ['rowid' if column == 'rowid' else f'"{column}"' for column in key_columns]
+        selected = ', '.join(f"{column} AS __key_{index}" for index, column in enumerate(quoted))
+        cursor = connection.execute(f"SELECT {selected}, * FROM {table_name} ORDER BY {', '.join(quoted)}")
+    else:
+        cursor = connection.execute(f"SELECT * FROM {table_name}")
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def row_source_key(row: sqlite3.Row, key_columns: List[str]) -> str:
+    """Identificador estável de uma linha legacy, a partir da chave lida por iter_table_batches"""
+    return '|'.join(str(row[f"__key_{index}"]) for index in range(len(key_columns)))
+
+
+def table_columns(connection: sqlite3.Connection, table_name: str) -> List[str]:
+    """Obtém os nomes das colunas de uma tabela sem ler linhas"""
+    cursor = connection.execute(f"SELECT * FROM {table_name} LIMIT 0")
+    columns = [description[0] for description in cursor.description]
+    cursor.close()
+    return columns
+
+
+def count_rows(connection: sqlite3.Connection, table_name: str) -> int:
+    """Conta as linhas de uma tabela"""
+    return connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Camada de escrita partilhada pelos scripts de migração
+Envia lotes para a API REST do Supabase (PostgREST) reutilizando ligações (keep-alive),
+limita o número de pedidos em curso, repete erros transitórios (429/5xx/timeouts) com
+backoff exponencial com jitter e grava os lotes que falham definitivamente num ficheiro
+dead-letter que pode ser reprocessado mais tarde. As leituras (select/rpc) usadas pela
+verificação da migração passam pelas mesmas ligações e repetições.
+
+Reprocessar um ficheiro dead-letter:
+    python supabase_writer.py replay dead_letter.jsonl
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configurações
+SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+
+DEFAULT_DEAD_LETTER_PATH = 'dead_letter.jsonl'
+
+# Estados HTTP considerados transitórios
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Erros definitivos que podem ser causados pelos dados de uma linha (ex.: violação de restrição);
+# só estes levam a dividir o lote. Os códigos PGRST* do PostgREST (coluna ou tabela desconhecida,
+# JSON inválido) e 401/403/404 afetam o lote inteiro.
+ROW_ERROR_STATUS = {400, 409, 422}
+
+# Tamanho máximo (codificado) de um filtro in.(...) num URL; acima disto a lista é dividida
+MAX_FILTER_LENGTH = 2000
+
+# Namespace para gerar ids determinísticos (idempotência entre tentativas e execuções)
+IDEMPOTENCY_NAMESPACE = uuid.UUID('6f1c2a9e-4b7d-4e8a-9c3f-2d5b8e7a1f40')
+
+
+def idempotency_key(table: str, source_key: Optional[str], row: Dict[str, Any]) -> str:
+    """Gera um UUID estável para uma linha a partir da sua origem (ou do conteúdo)"""
+    if source_key is None:
+        source_key = json.dumps(row, sort_keys=True, default=str)
+    return str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, f"{table}:{source_key}"))
+
+
+def in_filter_chunks(values: Sequence[str], max_length: int = MAX_FILTER_LENGTH) -> List[str]:
+    """Divide uma lista de valores em filtros PostgREST in.(...) que cabem num URL"""
+    chunks = []
+    current: List[str] = []
+    length = 0
+    for value in values:
+        quoted = '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+        quoted_length = len(quote(quoted, safe='')) + 3
+        if current and length + quoted_length > max_length:
+            chunks.append(f"in.({','.join(current)})")
+            current, length = [], 0
+        current.append(quoted)
+        length += quoted_length
+    if current:
+        chunks.append(f"in.({','.join(current)})")
+    return chunks
+
+
+class WriteError(Exception):
+    """Falha de escrita, com indicação se vale a pena repetir"""
+
+    def __init__(self, message: str, retryable: bool, retry_after: Optional[float] = None,
+                 status_code: Optional[int] = None, code: Optional[str] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status_code = status_code
+        self.code = code
+
+    @property
+    def row_level(self) -> bool:
+        """True se o erro pode vir de linhas concretas do lote (vale a pena dividi-lo)"""
+        return (not self.retryable and self.status_code in ROW_ERROR_STATUS
+                and not (self.code or '').startswith('PGRST'))
+
+
+class SupabaseWriter:
+    def __init__(self, url: str, key: str, max_in_flight: int = 4, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 30.0, timeout: float = 30.0,
+                 dead_letter_path: str = DEFAULT_DEAD_LETTER_PATH):
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.dead_letter_path = dead_letter_path
+
+        # Sessão com pool de ligações keep-alive (uma ligação por pedido em curso)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'apikey': key,
+            'Authorization': f"Bearer {key}",
+            'Content-Type': 'application/json'
+        })
+
+        # Limite de pedidos em curso; os resultados são contados por tabela, sem guardar os futures
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.stats_lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.dead_letter_lock = threading.Lock()
+
+    def step(self, table: str, rows: Sequence[Dict[str, Any]],
+             source_keys: Optional[Sequence[Optional[str]]] = None,
+             skip_existing: Optional[str] = None) -> Dict[str, Any]:
+        """Descreve uma escrita (com ids determinísticos); skip_existing salta linhas cujo valor nessa coluna já existe"""
+        step = {'table': table, 'rows': self.with_idempotency_keys(table, rows, source_keys)}
+        if skip_existing:
+            step['skip_existing'] = skip_existing
+        return step
+
+    def submit(self, table: str, rows: Sequence[Dict[str, Any]],
+               source_keys: Optional[Sequence[Optional[str]]] = None,
+               skip_existing: Optional[str] = None):
+        """Agenda a escrita de um lote; bloqueia enquanto houver max_in_flight pedidos em curso"""
+        steps = [self.step(table, rows, source_keys, skip_existing)]
+        self.in_flight.acquire()
+        try:
+            future = self.executor.submit(self._run_steps, steps)
+        except Exception:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(self._batch_done)
+
+    def write_chain(self, steps: List[Dict[str, Any]]) -> bool:
+        """Escreve (bloqueante) passos dependentes por ordem; se um falhar, o resto da cadeia vai para o dead-letter"""
+        return self._run_steps(steps)
+
+    def wait_all(self):
+        """Espera que todos os lotes agendados terminem"""
+        for _ in range(self.max_in_flight):
+            self.in_flight.acquire()
+        for _ in range(self.max_in_flight):
+            self.in_flight.release()
+
+    def close(self):
+        """Termina os pedidos em curso e fecha as ligações"""
+        self.wait_all()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def counts(self, table: str) -> Dict[str, int]:
+        """Linhas escritas, falhadas (dead-letter) e já existentes numa tabela, desde o início"""
+        with self.stats_lock:
+            return dict(self.stats.get(table, {'written': 0, 'failed': 0, 'skipped': 0}))
+
+    def _count(self, table: str, kind: str, amount: int):
+        with self.stats_lock:
+            table_stats = self.stats.setdefault(table, {'written': 0, 'failed': 0, 'skipped': 0})
+            table_stats[kind] += amount
+
+    def _totals(self) -> Tuple[int, int]:
+        """Total de linhas escritas e falhadas em todas as tabelas"""
+        with self.stats_lock:
+            return (sum(table_stats['written'] for table_stats in self.stats.values()),
+                    sum(table_stats['failed'] for table_stats in self.stats.values()))
+
+    def _batch_done(self, future: Future):
+        self.in_flight.release()
+        if future.exception() is not None:
+            print(f"Erro inesperado num lote: {future.exception()}")
+
+    def with_idempotency_keys(self, table: str, rows: Sequence[Dict[str, Any]],
+                              source_keys: Optional[Sequence[Optional[str]]] = None) -> List[Dict]:
+        """Atribui a cada linha um id determinístico, usado como chave de idempotência
+
+        O id é acrescentado no próprio dicionário (o payload construído por to_payload), sem copiar a linha.
+        """
+        for index, row in enumerate(rows):
+            if 'id' not in row:
+                source_key = source_keys[index] if source_keys else None
+                row['id'] = idempotency_key(table, source_key, row)
+        return list(rows)
+
+    def _run_steps(self, steps: List[Dict[str, Any]]) -> bool:
+        """Executa os passos por ordem; devolve True se todas as linhas foram escritas"""
+        # ids nossos substituídos pelos ids de linhas que já existiam (ex.: cliente já migrado)
+        id_remap: Dict[str, str] = {}
+        for index, step in enumerate(steps):
+            table = step['table']
+            rows = [self._remap(row, id_remap) for row in step['rows']]
+            try:
+                if step.get('skip_existing'):
+                    # As linhas já existentes ficam fora do passo (e de divisões ou do dead-letter)
+                    rows = self._drop_existing(table, rows, step['skip_existing'], id_remap)
+                    step = {key: value for key, value in step.items() if key != 'skip_existing'}
+                if rows:
+                    self._insert_with_retry(table, rows)
+                    self._count(table, 'written', len(rows))
+            except Exception as e:
+                # Lote simples com erro causado pelos dados: dividir para isolar as linhas inválidas.
+                # Erros de autenticação, tabela ou coluna inexistente vão para o dead-letter numa só entrada.
+                if len(steps) == 1 and len(rows) > 1 and isinstance(e, WriteError) and e.row_level:
+                    middle = len(rows) // 2
+                    first = self._run_steps([dict(step, rows=rows[:middle])])
+                    second = self._run_steps([dict(step, rows=rows[middle:])])
+                    return first and second
+
+                remaining = [dict(step, rows=rows)] + [
+                    dict(later, rows=[self._remap(row, id_remap) for row in later['rows']])
+                    for later in steps[index + 1:]
+                ]
+                print(f"Erro definitivo ao escrever em {table} ({len(rows)} linha(s)): {e}")
+                self.write_dead_letter(remaining, str(e))
+                for failed_step in remaining:
+                    self._count(failed_step['table'], 'failed', len(failed_step['rows']))
+                return False
+        return True
+
+    def _remap(self, row: Dict[str, Any], id_remap: Dict[str, str]) -> Dict[str, Any]:
+        if not id_remap:
+            return row
+        return {column: id_remap.get(value, value) if isinstance(value, str) else value
+                for column, value in row.items()}
+
+    def _drop_existing(self, table: str, rows: List[Dict], column: str, id_remap: Dict[str, str]) -> List[Dict]:
+        """Remove as linhas cujo valor em column já existe no Supabase, registando o id existente"""
+        existing = {item[column]: item['id']
+                    for item in self.select_in(table, column, [row[column] for row in rows], f"id,{column}")}
+        pending_rows = []
+        for row in rows:
+            if row[column] in existing:
+                id_remap[row['id']] = existing[row[column]]
+                print(f"Já existe em {table}: {row[column]}")
+                self._count(table, 'skipped', 1)
+            else:
+                pending_rows.append(row)
+        return pending_rows
+
+    def _insert_with_retry(self, table: str, rows: List[Dict]):
+        """Envia um lote, repetindo erros transitórios"""
+        self._with_retry(table, lambda: self._post(table, rows))
+
+    def _with_retry(self, description: str, send: Callable[[], Any]) -> Any:
+        """Executa um pedido, repetindo erros transitórios com backoff exponencial com jitter"""
+        attempt = 0
+        while True:
+            try:
+                return send()
+            except WriteError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                if e.retry_after is not None:
+                    delay = max(delay, min(e.retry_after, self.max_delay))
+                print(f"Erro transitório em {description} ({e}), nova tentativa em {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Backoff exponencial com jitter completo"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _post(self, table: str, rows: List[Dict]):
+        """Faz um único POST do lote para o PostgREST (upsert pela chave primária, sem corpo de resposta)"""
+        # Colunas explícitas: linhas sem um campo opcional ficam a null
+        columns = sorted({column for row in rows for column in row})
+        self._send(
+            'POST', table,
+            params={'columns': ','.join(columns)},
+            data=json.dumps(rows, default=str),
+            headers={
+                'Prefer': 'return=minimal,resolution=merge-duplicates',
+                'Idempotency-Key': idempotency_key(table, ','.join(row['id'] for row in rows), {})
+            }
+        )
+
+    def _send(self, method: str, path: str, **kwargs) -> Any:
+        """Faz um único pedido ao PostgREST e classifica os erros"""
+        try:
+            response = self.session.request(method, f"{self.rest_url}/{path}", timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            # Inclui ligações recusadas/cortadas, timeouts e corpos truncados (ChunkedEncodingError)
+            raise WriteError(f"{type(e).__name__}: {e}", retryable=True)
+
+        if response.status_code in RETRYABLE_STATUS:
+            raise WriteError(f"HTTP {response.status_code}", retryable=True,
+                             retry_after=self.parse_retry_after(response.headers.get('Retry-After')))
+        if response.status_code >= 400:
+            raise WriteError(f"HTTP {response.status_code}: {response.text[:200]}", retryable=False,
+                             status_code=response.status_code, code=self.parse_error_code(response))
+
+        if not response.content:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            raise WriteError(f"Resposta JSON inválida: {e}", retryable=True)
+
+    def parse_error_code(self, response: requests.Response) -> Optional[str]:
+        """Código do erro no corpo da resposta do PostgREST (SQLSTATE do Postgres ou PGRST*)"""
+        try:
+            body = response.json()
+        except ValueError:
+            return None
+        return body.get('code') if isinstance(body, dict) else None
+
+    def select(self, table: str, params: Dict[str, Any]) -> List[Dict]:
+        """Lê linhas (GET com filtros PostgREST), com as mesmas repetições das escritas"""
+        return self._with_retry(table, lambda: self._send('GET', table, params=params)) or []
+
+    def select_in(self, table: str, column: str, values: Sequence[str], columns: str) -> List[Dict]:
+        """Lê as linhas cujo valor em column está na lista, em pedidos com URLs de tamanho limitado"""
+        rows = []
+        for condition in in_filter_chunks(values):
+            rows.extend(self.select(table, {'select': columns, column: condition}))
+        return rows
+
+    def rpc(self, function: str, args: Dict[str, Any]) -> Any:
+        """Chama uma função SQL exposta pelo PostgREST (/rpc/<função>)"""
+        return self._with_retry(function, lambda: self._send('POST', f"rpc/{function}", data=json.dumps(args)))
+
+    def parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        """Converte o cabeçalho Retry-After (em segundos) para float"""
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def write_dead_letter(self, steps: List[Dict[str, Any]], error: str):
+        """Acrescenta ao ficheiro dead-letter uma entrada com os passos por escrever (uma linha JSON)"""
+        entry = {
+            'steps': steps,
+            'error': error,
+            'failed_at': datetime.now().isoformat()
+        }
+        self._append_entries(self.dead_letter_path, [entry])
+
+    def _append_entries(self, path: str, entries: List[Dict[str, Any]]):
+        with self.dead_letter_lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, default=str, ensure_ascii=False) + '\n')
+
+    def _read_entries(self, path: str) -> List[Dict[str, Any]]:
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def replay_dead_letters(self, path: Optional[str] = None) -> Tuple[int, int]:
+        """Reenvia as entradas de um ficheiro dead-letter; as que voltarem a falhar ficam no ficheiro"""
+        path = path or self.dead_letter_path
+        replaying_path = f"{path}.replaying"
+
+        # Um reprocessamento que terminou abruptamente (ex.: processo morto) pode ter deixado entradas em .replaying
+        entries = self._read_entries(replaying_path) + self._read_entries(path)
+        if not entries:
+            print(f"Sem entradas para reprocessar em {path}")
+            return 0, 0
+
+        # Guardar todas as entradas em .replaying antes de esvaziar o ficheiro principal
+        with open(f"{replaying_path}.tmp", 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, default=str, ensure_ascii=False) + '\n')
+        os.replace(f"{replaying_path}.tmp", replaying_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+        # As entradas que falharem de novo são escritas no ficheiro principal
+        original_path, self.dead_letter_path = self.dead_letter_path, path
+        written_before, failed_before = self._totals()
+        processed = 0
+        try:
+            for entry in entries:
+                steps = entry.get('steps') or [{'table': entry['table'], 'rows': entry['rows']}]
+                self._run_steps(steps)
+                processed += 1
+        except BaseException:
+            # Devolver ao ficheiro as entradas ainda não reprocessadas (repetir uma escrita é seguro)
+            self._append_entries(path, entries[processed:])
+            os.remove(replaying_path)
+            raise
+        else:
+            os.remove(replaying_path)
+        finally:
+            self.dead_letter_path = original_path
+
+        written_after, failed_after = self._totals()
+        replayed_count = written_after - written_before
+        failed_count = failed_after - failed_before
+        print(f"Linhas reprocessadas: {replayed_count}")
+        print(f"Linhas ainda com erro: {failed_count}")
+        return replayed_count, failed_count
+
+
+def main():
+    """Função principal: reprocessa um ficheiro dead-letter"""
+    if len(sys.argv) < 2 or sys.argv[1] != 'replay':
+        print("Uso: python supabase_writer.py replay [ficheiro dead-letter]")
+        return
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("Erro: Variáveis de ambiente SUPABASE não configuradas")
+        return
+
+    path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DEAD_LETTER_PATH
+    writer = SupabaseWriter(SUPABASE_URL, SUPABASE_KEY)
+    try:
+        writer.replay_dead_letters(path)
+    finally:
+        writer.close()
+
+if __name__ == "__main__":
+    main()
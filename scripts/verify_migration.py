@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Verificação pós-migração entre a base de dados legacy e o Supabase
+Em vez de comparar linha a linha, calcula em ambos os lados impressões digitais
+(fingerprints) independentes da ordem: cada linha é normalizada nas colunas mapeadas,
+resumida com md5 e as somas dos hashes são agregadas por partição (prefixo do id).
+Só as partições cujas impressões digitais diferem são lidas linha a linha.
+
+No Supabase só entram as linhas escritas por migrate_from_sql.py a partir da tabela legacy
+(coluna migration_source = 'sql:<tabela>'); linhas criadas na aplicação ou migradas do Drive
+são ignoradas. As impressões digitais são calculadas pela função SQL migration_fingerprints
+(ver supabase-migration-fingerprints.sql); se a função não existir, as linhas são lidas
+em páginas e o cálculo é feito localmente.
+
+As linhas são identificadas pelo id determinístico atribuído pelo supabase_writer. Clientes
+legacy que não foram migrados porque já existia no Supabase um cliente com o mesmo nome são
+indicados à parte e não contam como diferenças.
+
+Uso:
+    python verify_migration.py
+"""
+
+import hashlib
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from migration_records import DEFAULT_BATCH_SIZE, iter_table_batches, row_source_key, table_columns
+from migrate_from_sql import APPOINTMENT_TABLES, CLIENT_TABLES, SUPABASE_KEY, SUPABASE_URL, SQLToSupabaseMigrator
+from supabase_writer import WriteError, idempotency_key
+
+# Colunas comparadas em cada tabela do Supabase (a ordem faz parte da normalização)
+FINGERPRINT_COLUMNS = {
+    'clients': ['id', 'name', 'birth_date', 'email', 'phone', 'notes'],
+    'appointments': ['id', 'client_id', 'doctor_id', 'room_id', 'date', 'duration_min', 'status', 'notes']
+}
+TIMESTAMP_COLUMNS = {'date'}
+
+NULL_MARKER = '\\N'
+FIELD_SEPARATOR = '\x1f'
+
+# Número de dígitos hexadecimais do id usados como partição (2 -> 256 partições)
+DEFAULT_PREFIX_LEN = 2
+
+# {partição: [número de linhas, soma dos hashes]}
+Fingerprints = Dict[str, List[int]]
+
+
+def normalize_value(column: str, value: Any) -> str:
+    """Converte um valor para a forma textual usada no hash (igual à da função SQL)"""
+    if value is None:
+        return NULL_MARKER
+    if column in TIMESTAMP_COLUMNS:
+        timestamp = datetime.fromisoformat(str(value))
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp.strftime('%Y-%m-%dT%H:%M:%S')
+    return str(value)
+
+
+def row_hash(table: str, row: Dict[str, Any]) -> int:
+    """Hash de 60 bits de uma linha normalizada (cabe num bigint no Postgres)"""
+    text = FIELD_SEPARATOR.join(normalize_value(column, row.get(column)) for column in FINGERPRINT_COLUMNS[table])
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:15], 16)
+
+
+def add_to_fingerprints(fingerprints: Fingerprints, partition: str, hash_value: int):
+    """Acumula uma linha na impressão digital da sua partição"""
+    fingerprint = fingerprints.setdefault(partition, [0, 0])
+    fingerprint[0] += 1
+    fingerprint[1] += hash_value
+
+
+def partition_bounds(partition: str) -> Tuple[str, Optional[str]]:
+    """Intervalo de ids [início, fim) de uma partição, no formato UUID"""
+    def as_uuid(hex_digits: str) -> str:
+        hex_digits = hex_digits.ljust(32, '0')
+        return f"{hex_digits[:8]}-{hex_digits[8:12]}-{hex_digits[12:16]}-{hex_digits[16:20]}-{hex_digits[20:]}"
+
+    upper_value = int(partition, 16) + 1
+    if upper_value >= 16 ** len(partition):
+        return as_uuid(partition), None
+    return as_uuid(partition), as_uuid(format(upper_value, f"0{len(partition)}x"))
+
+
+class MigrationVerifier:
+    def __init__(self, migrator: SQLToSupabaseMigrator, prefix_len: int = DEFAULT_PREFIX_LEN,
+                 page_size: int = 1000):
+        self.migrator = migrator
+        self.writer = migrator.writer
+        self.prefix_len = prefix_len
+        self.page_size = page_size
+
+    def legacy_table(self, table: str) -> Optional[str]:
+        """Tabela legacy de onde vêm as linhas de uma tabela do Supabase"""
+        return self.migrator.find_table(CLIENT_TABLES if table == 'clients' else APPOINTMENT_TABLES)
+
+    def legacy_rows(self, table: str, partitions: Optional[set] = None) -> Iterator[Dict[str, Any]]:
+        """Reconstrói, a partir da base legacy, as linhas que a migração envia para o Supabase"""
+        if table == 'clients':
+            yield from self._legacy_clients(partitions)
+        else:
+            yield from self._legacy_appointments(partitions)
+
+    def _legacy_clients(self, partitions: Optional[set]) -> Iterator[Dict[str, Any]]:
+        client_table = self.legacy_table('clients')
+        if not client_table:
+            return
+        column_mapping = self.migrator.map_client_columns(table_columns(self.migrator.connection, client_table))
+
+        # Tal como em migrate_clients, só a primeira ocorrência de cada nome é migrada
+        seen_names = set()
+        for rows in iter_table_batches(self.migrator.connection, client_table, DEFAULT_BATCH_SIZE):
+            for row in rows:
+                client_record = self.migrator.transform_client_data(row, column_mapping)
+                if not client_record or client_record.name in seen_names:
+                    continue
+                seen_names.add(client_record.name)
+
+                payload = client_record.to_payload()
+                source_key = self.migrator.client_source_key(client_table, client_record.name)
+                payload['id'] = idempotency_key('clients', source_key, payload)
+                if partitions is None or payload['id'][:self.prefix_len] in partitions:
+                    yield payload
+
+    def _legacy_appointments(self, partitions: Optional[set]) -> Iterator[Dict[str, Any]]:
+        appointment_table = self.legacy_table('appointments')
+        if not appointment_table:
+            return
+        column_mapping = self.migrator.map_appointment_columns(
+            table_columns(self.migrator.connection, appointment_table))
+
+        key_columns = self.migrator.appointment_key_columns(appointment_table)
+        for rows in iter_table_batches(self.migrator.connection, appointment_table, DEFAULT_BATCH_SIZE, key_columns):
+            for row in rows:
+                appointment_record = self.migrator.transform_appointment_data(row, column_mapping)
+                if not appointment_record:
+                    continue
+
+                payload = appointment_record.to_payload()
+                source_key = self.migrator.appointment_source_key(appointment_table, row_source_key(row, key_columns))
+                payload['id'] = idempotency_key('appointments', source_key, payload)
+                if partitions is None or payload['id'][:self.prefix_len] in partitions:
+                    yield payload
+
+    def remote_rows(self, table: str, source: str, partition: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Lê as linhas de uma origem em páginas (paginação por id), opcionalmente de uma só partição"""
+        lower, upper = partition_bounds(partition) if partition else (None, None)
+        last_id = None
+        while True:
+            id_filters = []
+            if last_id is not None:
+                id_filters.append(f"gt.{last_id}")
+            elif lower is not None:
+                id_filters.append(f"gte.{lower}")
+            if upper is not None:
+                id_filters.append(f"lt.{upper}")
+
+            params = {
+                'select': ','.join(FINGERPRINT_COLUMNS[table]),
+                'order': 'id.asc',
+                'limit': str(self.page_size),
+                'migration_source': f"eq.{source}"
+            }
+            if id_filters:
+                params['id'] = id_filters
+            page = self.writer.select(table, params)
+            yield from page
+
+            if len(page) < self.page_size:
+                break
+            last_id = page[-1]['id']
+
+    def legacy_fingerprints(self, table: str) -> Fingerprints:
+        """Impressões digitais por partição do lado legacy (numa só passagem)"""
+        fingerprints: Fingerprints = {}
+        for row in self.legacy_rows(table):
+            add_to_fingerprints(fingerprints, row['id'][:self.prefix_len], row_hash(table, row))
+        return fingerprints
+
+    def remote_fingerprints(self, table: str, source: str) -> Fingerprints:
+        """Impressões digitais por partição do lado Supabase (calculadas no servidor se possível)"""
+        try:
+            result = self.writer.rpc('migration_fingerprints',
+                                     {'p_table': table, 'p_source': source, 'p_prefix_len': self.prefix_len})
+            return {item['partition']: [int(item['row_count']), int(item['hash_sum'])] for item in result or []}
+        except WriteError as e:
+            if e.status_code != 404:
+                raise
+            print("Função migration_fingerprints não encontrada, a calcular localmente a partir das páginas")
+
+        fingerprints: Fingerprints = {}
+        for row in self.remote_rows(table, source):
+            add_to_fingerprints(fingerprints, row['id'][:self.prefix_len], row_hash(table, row))
+        return fingerprints
+
+    def drill_down(self, table: str, source: str, partitions: List[str]) -> Dict[str, List[str]]:
+        """Compara linha a linha apenas as partições com diferenças"""
+        legacy_rows = {row['id']: row for row in self.legacy_rows(table, set(partitions))}
+        remote_hashes = {}
+        for partition in partitions:
+            for row in self.remote_rows(table, source, partition):
+                remote_hashes[row['id']] = row_hash(table, row)
+
+        missing = sorted(legacy_rows.keys() - remote_hashes.keys())
+        existing = []
+        if table == 'clients' and missing:
+            # Clientes saltados na migração por já existir um com o mesmo nome no Supabase
+            names = {legacy_rows[row_id]['name'] for row_id in missing}
+            existing_names = {item['name'] for item in self.writer.select_in('clients', 'name', list(names), 'name')}
+            existing = [row_id for row_id in missing if legacy_rows[row_id]['name'] in existing_names]
+            missing = [row_id for row_id in missing if legacy_rows[row_id]['name'] not in existing_names]
+
+        return {
+            'missing': missing,
+            'unexpected': sorted(remote_hashes.keys() - legacy_rows.keys()),
+            'different': sorted(row_id for row_id in legacy_rows.keys() & remote_hashes.keys()
+                                if row_hash(table, legacy_rows[row_id]) != remote_hashes[row_id]),
+            'existing': existing
+        }
+
+    def verify_table(self, table: str) -> bool:
+        """Verifica uma tabela; devolve True se ambos os lados coincidem"""
+        print(f"\n=== Verificando {table} ===")
+        legacy_table = self.legacy_table(table)
+        if not legacy_table:
+            print(f"Tabela legacy para {table} não encontrada")
+            return True
+
+        source = self.migrator.migration_source(legacy_table)
+        legacy = self.legacy_fingerprints(table)
+        remote = self.remote_fingerprints(table, source)
+
+        legacy_count = sum(fingerprint[0] for fingerprint in legacy.values())
+        remote_count = sum(fingerprint[0] for fingerprint in remote.values())
+        print(f"Linhas legacy ({legacy_table}): {legacy_count}")
+        print(f"Linhas Supabase (migration_source = {source}): {remote_count}")
+
+        mismatched = sorted(partition for partition in legacy.keys() | remote.keys()
+                            if legacy.get(partition) != remote.get(partition))
+        if not mismatched:
+            print(f"{table}: OK ({len(legacy)} partições coincidem)")
+            return True
+
+        print(f"Partições com diferenças: {len(mismatched)} de {len(legacy.keys() | remote.keys())}")
+        report = self.drill_down(table, source, mismatched)
+        for kind, label in [('missing', 'Em falta no Supabase'),
+                            ('unexpected', 'Só no Supabase'),
+                            ('different', 'Com conteúdo diferente'),
+                            ('existing', 'Não migrados (já existiam no Supabase)')]:
+            if kind == 'existing' and not report[kind]:
+                continue
+            print(f"{label}: {len(report[kind])}")
+            for row_id in report[kind][:20]:
+                print(f"  {row_id}")
+        return not (report['missing'] or report['unexpected'] or report['different'])
+
+    def verify(self) -> bool:
+        """Verifica clientes e consultas"""
+        results = [self.verify_table(table) for table in FINGERPRINT_COLUMNS]
+        return all(results)
+
+
+def main():
+    """Função principal"""
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("Erro: Variáveis de ambiente SUPABASE não configuradas")
+        return
+    
+    db_path = input("Digite o caminho para a base de dados legacy (*.db, *.sqlite): ").strip()
+    
+    if not os.path.exists(db_path):
+        print(f"Arquivo não encontrado: {db_path}")
+        return
+    
+    migrator = SQLToSupabaseMigrator(db_path)
+    
+    if not migrator.connect_to_legacy_db():
+        return
+    
+    try:
+        if MigrationVerifier(migrator).verify():
+            print("\n=== Verificação Concluída: sem diferenças ===")
+        else:
+            print("\n=== Verificação Concluída: foram encontradas diferenças ===")
+    finally:
+        migrator.close_connection()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+-- Migration Fingerprints
+-- Executar antes de correr os scripts de migração (scripts/migrate_from_*.py).
+--
+-- 1. Coluna migration_source: indica de onde veio cada linha migrada ('sql:<tabela legacy>' para
+--    migrate_from_sql.py, 'drive' para migrate_from_drive.py). Linhas criadas na aplicação ficam NULL.
+-- 2. Função usada por scripts/verify_migration.py para verificar a migração sem ler todas as linhas.
+--    Devolve, por partição (prefixo hexadecimal do id), o número de linhas e a soma dos hashes
+--    das linhas normalizadas, apenas para as linhas com o migration_source indicado.
+--    A normalização tem de coincidir com a de verify_migration.py:
+--    colunas separadas por chr(31), NULL como '\N', datas em UTC 'YYYY-MM-DDTHH:MI:SS',
+--    hash = primeiros 15 dígitos hexadecimais do md5 (60 bits).
+--    scripts/check_fingerprints_sql.py confirma que ambos os cálculos coincidem.
+
+-- 1. Origem das linhas migradas
+ALTER TABLE clients
+ADD COLUMN IF NOT EXISTS migration_source TEXT;
+
+ALTER TABLE appointments
+ADD COLUMN IF NOT EXISTS migration_source TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_clients_migration_source ON clients(migration_source);
+CREATE INDEX IF NOT EXISTS idx_appointments_migration_source ON appointments(migration_source);
+
+-- 2. Impressões digitais por partição
+CREATE OR REPLACE FUNCTION migration_fingerprints(p_table TEXT, p_source TEXT, p_prefix_len INTEGER DEFAULT 2)
+RETURNS TABLE (partition TEXT, row_count BIGINT, hash_sum TEXT)
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  row_text TEXT;
+BEGIN
+  -- Apenas tabelas conhecidas (o nome é usado em SQL dinâmico)
+  IF p_table = 'clients' THEN
+    row_text := 'concat_ws(chr(31), id::text, coalesce(name, ''\N''), '
+      || 'coalesce(to_char(birth_date, ''YYYY-MM-DD''), ''\N''), coalesce(email, ''\N''), '
+      || 'coalesce(phone, ''\N''), coalesce(notes, ''\N''))';
+  ELSIF p_table = 'appointments' THEN
+    row_text := 'concat_ws(chr(31), id::text, coalesce(client_id::text, ''\N''), '
+      || 'coalesce(doctor_id::text, ''\N''), coalesce(room_id::text, ''\N''), '
+      || 'coalesce(to_char(date AT TIME ZONE ''UTC'', ''YYYY-MM-DD"T"HH24:MI:SS''), ''\N''), '
+      || 'coalesce(duration_min::text, ''\N''), coalesce(status, ''\N''), coalesce(notes, ''\N''))';
+  ELSE
+    RAISE EXCEPTION 'Tabela não suportada: %', p_table;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'SELECT left(id::text, %s) AS partition, count(*) AS row_count, '
+    || 'sum((''x'' || substr(md5(%s), 1, 15))::bit(60)::bigint)::text AS hash_sum '
+    || 'FROM %I WHERE migration_source = %L GROUP BY 1',
+    p_prefix_len, row_text, p_table, p_source
+  );
+END;
+$$;
+
+-- Apenas o service role (usado pelos scripts de migração) pode executar a função
+REVOKE ALL ON FUNCTION migration_fingerprints(TEXT, TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION migration_fingerprints(TEXT, TEXT, INTEGER) TO service_role;